@@ -0,0 +1,129 @@
+"""
+Kernels evaluating packed Curve parameters, used by Knapsack objective and derivative.
+NumPy implementations are used by default. Set environment variable KNAPSACK_NUMBA=1 to compile them with numba
+instead: calls get faster, but importing numba and loading its cache costs about a second on every start, while
+a whole SLSQP solve of a few curves takes well under a millisecond either way.
+
+Every kernel takes constants precomputed by Curve: scale divides x (price * cap * ec50 for 'basic' curves,
+price * cap for 'log' ones) and base is subtracted from 'log' response (zero for 'basic' curves).
+"""
+
+import os
+
+from numpy import errstate, exp, flatnonzero
+
+if os.environ.get('KNAPSACK_NUMBA') == '1':
+    from numba import njit
+else:
+    njit = None
+
+# fast-math flags without 'nnan'/'ninf', and NumPy error model below: zero budget relies on inf in power
+# giving zero response instead of ZeroDivisionError
+_FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=_FASTMATH, error_model='numpy')
+    def response(x, cap, ec50, steep, mult, scale, base, is_log):
+        """
+        Total response of packed curves.
+        :param x: float64 array with budget for every curve
+        :param is_log: boolean array, True for 'log' curves and False for 'basic' ones
+        :return: float
+        """
+        s = 0.0
+        for i in range(x.size):
+            if is_log[i]:
+                s += (cap[i] / (1.0 + exp(-steep[i] * x[i] / scale[i] - ec50[i])) - base[i]) * mult[i]
+            else:
+                s += mult[i] * cap[i] / (1.0 + (x[i] / scale[i]) ** (-steep[i]))
+        return s
+
+    @njit(cache=True, fastmath=_FASTMATH, error_model='numpy')
+    def response_grad(out, x, cap, ec50, steep, mult, scale, base, is_log):
+        """
+        Write derivative of every packed curve to out.
+        :param out: float64 array of same size as x
+        :return: out
+        """
+        for i in range(x.size):
+            if is_log[i]:
+                e = exp(steep[i] * x[i] / scale[i] + ec50[i])
+                out[i] = steep[i] * mult[i] * e / (e + 1.0) ** 2
+            else:
+                r = (x[i] / scale[i]) ** steep[i]
+                out[i] = cap[i] * steep[i] * mult[i] * r / (x[i] * (1.0 + r) ** 2)
+        return out
+
+    @njit(cache=True, fastmath=_FASTMATH, error_model='numpy')
+    def response_and_grad(out, x, cap, ec50, steep, mult, scale, base, is_log):
+        """
+        Total response of packed curves and derivative of every curve written to out.
+        Response and derivative share their exponent, so it is evaluated once per curve.
+        :param out: float64 array of same size as x
+        :return: float
+        """
+        s = 0.0
+        for i in range(x.size):
+            if is_log[i]:
+                e = exp(steep[i] * x[i] / scale[i] + ec50[i])
+                # exp(-u) == 1 / exp(u)
+                s += (cap[i] / (1.0 + 1.0 / e) - base[i]) * mult[i]
+                out[i] = steep[i] * mult[i] * e / (e + 1.0) ** 2
+            else:
+                r = (x[i] / scale[i]) ** steep[i]
+                # r ** -1 == ratio ** (-steep)
+                s += mult[i] * cap[i] / (1.0 + 1.0 / r)
+                out[i] = cap[i] * steep[i] * mult[i] * r / (x[i] * (1.0 + r) ** 2)
+        return s
+
+else:
+    def response(x, cap, ec50, steep, mult, scale, base, is_log):
+        # zero budget gives inf in power and zero response for 'basic' curves
+        with errstate(divide='ignore'):
+            impact = mult * cap / (1 + (x / scale) ** (-steep))
+        li = flatnonzero(is_log)
+        if li.size:
+            impact[li] = (cap[li] / (1 + exp(-steep[li] * x[li] / scale[li] - ec50[li])) - base[li]) * mult[li]
+        return impact.sum()
+
+    def response_grad(out, x, cap, ec50, steep, mult, scale, base, is_log):
+        # basic formula is evaluated for every curve and gives 0 / 0 at zero budget, like numba branch it stays
+        # silent there: 'basic' derivative is nan, 'log' entries are overwritten below
+        with errstate(divide='ignore', invalid='ignore'):
+            r = (x / scale) ** steep
+            out[:] = cap * steep * mult * r / (x * (1 + r) ** 2)
+        li = flatnonzero(is_log)
+        if li.size:
+            e = exp(steep[li] * x[li] / scale[li] + ec50[li])
+            out[li] = steep[li] * mult[li] * e / (e + 1) ** 2
+        return out
+
+    def response_and_grad(out, x, cap, ec50, steep, mult, scale, base, is_log):
+        # see response_grad about zero budget
+        with errstate(divide='ignore', invalid='ignore'):
+            r = (x / scale) ** steep
+            impact = mult * cap / (1 + 1 / r)
+            out[:] = cap * steep * mult * r / (x * (1 + r) ** 2)
+        li = flatnonzero(is_log)
+        if li.size:
+            e = exp(steep[li] * x[li] / scale[li] + ec50[li])
+            impact[li] = (cap[li] / (1 + 1 / e) - base[li]) * mult[li]
+            out[li] = steep[li] * mult[li] * e / (e + 1) ** 2
+        return impact.sum()
+
+
+def responses(x, cap, ec50, steep, mult, scale, base, is_log):
+    """
+    Response of every packed curve for every budget in x, computed with one broadcasted expression.
+    :param x: 1D float64 array of budgets shared by all curves
+    :return: float64 array of shape (x.size, number of curves)
+    """
+    x = x[:, None]
+    # zero budget gives inf in power and zero response for 'basic' curves
+    with errstate(divide='ignore'):
+        r = mult * cap / (1 + (x / scale) ** (-steep))
+    li = flatnonzero(is_log)
+    if li.size:
+        r[:, li] = (cap[li] / (1 + exp(-steep[li] * x / scale[li] - ec50[li])) - base[li]) * mult[li]
+    return r
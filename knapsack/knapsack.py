@@ -1,8 +1,24 @@
 # __all__ = ["Knapsack", ]
 
-from numpy import array, linspace
-from pandas import DataFrame
-from scipy.optimize import minimize
+from numpy import (append, array, array_equal, asarray, clip, column_stack, empty, exp, float64, linspace, log,
+                   maximum, multiply, ones)
+from scipy.optimize import LinearConstraint, differential_evolution, minimize
+
+from ._kernels import response, response_and_grad, response_grad, responses
+from .stones import Curve
+
+
+def _budgets(x, n):
+    """
+    Convert spends to float64 array for packed kernels, which don't check bounds themselves.
+    :param x: spends, one per curve
+    :param n: number of curves
+    :return: numpy.array
+    """
+    x = asarray(x, dtype=float64)
+    if x.shape != (n,):
+        raise ValueError("Expected {0} budgets, got array of shape {1}".format(n, x.shape))
+    return x
 
 
 class Knapsack(object):
@@ -19,6 +35,11 @@ class Knapsack(object):
         self.solution = None
         self.__bounds = []
         self.__curves = []
+        self.__packed = False
+        self.__packed_args = None
+        self.__fun = None
+        self.__derivative = None
+        self.__constraints = None
 
     def get_curves(self):
         """
@@ -47,14 +68,66 @@ class Knapsack(object):
         self.__curves.append(curve)
         self.__bounds.append([lower, upper])
 
+    def _refresh(self):
+        """
+        Repack curves and drop cached closures if curves were added or parameters of any Curve changed since last
+        packing. Curve replaces its argument tuple on every parameter change, so comparing identities is enough.
+        """
+        args = [curve._args if isinstance(curve, Curve) else curve for curve in self.__curves]
+        last = self.__packed_args
+        if last is not None and len(args) == len(last) and all(a is b for a, b in zip(args, last)):
+            return
+        self.__packed_args = args
+        self._pack()
+        # closures are bound to packed arrays and curve count, rebuild them on next access
+        self.__fun = None
+        self.__derivative = None
+        self.__constraints = None
+
+    def _pack(self):
+        """
+        Stack parameters of assigned Curve objects into float64 arrays, so objective and derivative can be evaluated
+        for all curves at once. If any curve is not a Curve instance (MixedCurve or custom response function),
+        problem stays unpacked and every curve is called separately.
+        """
+        curves = self.__curves
+        self.__packed = all(isinstance(curve, Curve) for curve in curves)
+        if not self.__packed:
+            return
+
+        self._cap = array([curve.cap for curve in curves], dtype=float64)
+        self._ec50 = array([curve.ec50 for curve in curves], dtype=float64)
+        self._steep = array([curve.steep for curve in curves], dtype=float64)
+        self._mult = array([curve.multiplier for curve in curves], dtype=float64)
+        # constants precomputed by Curve, see _kernels
+        self._scale = array([curve._scale for curve in curves], dtype=float64)
+        self._base = array([curve._base for curve in curves], dtype=float64)
+        self._type_mask = array([curve.type == 'log' for curve in curves], dtype=bool)
+        self._params = self._cap, self._ec50, self._steep, self._mult, self._scale, self._base, self._type_mask
+
     @property
     def fun(self):
-        def f(x, sign=1.0):
-            impact = 0
-            for i, curve in enumerate(self.__curves):
-                impact += curve(x[i])
+        self._refresh()
+        if self.__fun is None:
+            self.__fun = self._build_fun()
+        return self.__fun
+
+    def _build_fun(self):
+        if not self.__packed:
+            def f(x, sign=1.0):
+                impact = 0
+                for i, curve in enumerate(self.__curves):
+                    impact += curve(x[i])
+
+                return sign * impact
 
-            return sign * impact
+            return f
+
+        packed = self._params
+        n = len(self.__curves)
+
+        def f(x, sign=1.0):
+            return sign * response(_budgets(x, n), *packed)
 
         return f
 
@@ -75,26 +148,77 @@ class Knapsack(object):
 
     @property
     def derivative(self):
+        self._refresh()
+        if self.__derivative is None:
+            self.__derivative = self._build_derivative()
+        return self.__derivative
 
+    def _build_derivative(self):
         # despite most of the time sign == 1.0, this feature is needed if we want to minimize something
+        if not self.__packed:
+            def f(x, sign=1.0):
+                return array([sign * curve.derivative(x[i]) for i, curve in enumerate(self.__curves)])
+
+            return f
+
+        packed = self._params
+        n = len(self.__curves)
+
         def f(x, sign=1.0):
-            return [sign * curve.derivative(x[i]) for i, curve in enumerate(self.__curves)]
+            return sign * response_grad(empty(n), _budgets(x, n), *packed)
 
         return f
 
+    def _shared_evaluation(self):
+        """
+        Objective and derivative for packed problem that share one kernel evaluation. SLSQP asks for both at the
+        same point, so response and gradient are computed together and kept for last x.
+        Returned derivative overwrites and returns the same array on every call, which is only safe for solvers
+        that consume gradient before next evaluation (SLSQP): quasi-Newton Hessian updates keep previous gradient.
+        :return: tuple(callable, callable)
+        """
+        packed = self._params
+        n = len(self.__curves)
+        grad = empty(n)
+        out = empty(n)
+        last = {'x': None, 'value': None}
+
+        def evaluate(x):
+            if last['x'] is None or not array_equal(x, last['x']):
+                x = _budgets(x, n)
+                last['value'] = response_and_grad(grad, x, *packed)
+                last['x'] = x.copy()
+            return last['value']
+
+        def fun(x, sign=1.0):
+            return sign * evaluate(x)
+
+        def jac(x, sign=1.0):
+            evaluate(x)
+            return multiply(sign, grad, out=out)
+
+        return fun, jac
+
     @property
     def constraints(self):
         """
-        Generate callable constraints for SLSQP optimization.
+        Callable constraints for SLSQP optimization.
         :return: dict{str, callable, callable}
         """
+        self._refresh()
+        if self.__constraints is None:
+            self.__constraints = self._build_constraints()
+        return self.__constraints
+
+    def _build_constraints(self):
+        # constraint is linear, so its jacobian is the same for every x
+        ones_jac = ones(len(self.__curves))
 
         def fun(x):
-            spend = sum(x)
-            return spend - self.budget
+            return x.sum() - self.budget
 
         def jac(x):
-            return array([1.0 for _ in range(len(x))])
+            return ones_jac
 
         constraints = (
             {
@@ -112,12 +236,14 @@ class Knapsack(object):
         :return: dict{str, callable, callable}
         """
 
+        # constraint is linear, so its jacobian is the same for every x
+        ones_jac = ones(len(self.__curves))
+
         def fun(x):
-            spend = sum(x)
-            return spend - self.budget
+            return x.sum() - self.budget
 
         def jac(x):
-            return array([1.0 for _ in range(len(x))])
+            return ones_jac
 
         constraints = (
             {
@@ -128,33 +254,156 @@ class Knapsack(object):
         )
         return constraints
 
-    def solve(self, disp=True, maxiter=100):
+    def _initial_guess(self):
+        """
+        Starting point for optimization: budget left after lower bounds is split between curves proportionally to
+        width of their bounds. This point satisfies budget constraint and lies inside bounds whenever problem is
+        feasible, otherwise it is clipped into bounds.
+        :return: numpy.array
+        """
+        lower = array([bound[0] for bound in self.__bounds], dtype=float64)
+        upper = array([bound[1] for bound in self.__bounds], dtype=float64)
+        width = upper - lower
+        if width.sum() <= 0:
+            return lower
+        x0 = lower + (self.budget - lower.sum()) * width / width.sum()
+        return clip(x0, lower, upper)
+
+    def _global_guess(self, seed=None):
+        """
+        Starting point found by a short differential evolution run, for problems where local search from
+        ```_initial_guess``` stalls in convex parts of s-shaped curves. Candidates are rescaled so that spend above
+        lower bounds matches budget and clipped into bounds before evaluation.
+        :param seed: seed for differential evolution, see ```scipy.optimize.differential_evolution```
+        :return: numpy.array
+        """
+        lower = array([bound[0] for bound in self.__bounds], dtype=float64)
+        upper = array([bound[1] for bound in self.__bounds], dtype=float64)
+        free = self.budget - lower.sum()
+        fun = self.fun
+
+        def project(x):
+            extra = x - lower
+            total = extra.sum()
+            if total <= 0:
+                return lower
+            return clip(lower + extra * free / total, lower, upper)
+
+        result = differential_evolution(lambda x: fun(project(x), -1.0), self.__bounds, maxiter=10, popsize=8,
+                                        polish=False, seed=seed)
+        return project(result.x)
+
+    def solve(self, disp=True, maxiter=100, method='SLSQP', robust=False, ftol=1e-8, seed=None):
         """
         Solve optimization problem for budget.
         :param disp: Set to True to print convergence messages
         :param maxiter: Maximum number of iterations to perform
+        :param method: 'SLSQP', 'trust-constr' or 'softmax'. trust-constr gets budget constraint in linear form,
+        softmax solves unconstrained problem with L-BFGS-B (see ```_solve_softmax```)
+        :param robust: Set to True to seed local method with a short differential evolution run, which is slower
+        but less likely to stop in a poor local optimum
+        :param ftol: Precision goal for objective value, used by SLSQP. Other methods keep their own defaults
+        :param seed: seed for differential evolution when ```robust``` is True, pass it to reproduce results
         :return: numpy.array with corresponding budgets
         """
-        constraints = self.constraints
-        derivative = self.derivative
-        x0 = array([bound[0] for bound in self.__bounds])
-
-        self.solution = minimize(
-            fun=self.fun,
-            x0=x0,
-            args=(-1.0,),
-            method='SLSQP',
-            jac=derivative,
-            bounds=self.__bounds,
-            constraints=constraints,
-            options={
-                'disp': disp,
-                'maxiter': maxiter
-            }
-        )
+        self._refresh()
+        x0 = self._global_guess(seed) if robust else self._initial_guess()
+
+        if method == 'SLSQP':
+            if self.__packed:
+                fun, derivative = self._shared_evaluation()
+            else:
+                fun, derivative = self.fun, self.derivative
+
+            self.solution = minimize(
+                fun=fun,
+                x0=x0,
+                args=(-1.0,),
+                method='SLSQP',
+                jac=derivative,
+                bounds=self.__bounds,
+                constraints=self.constraints,
+                options={
+                    'disp': disp,
+                    'maxiter': maxiter,
+                    'ftol': ftol
+                }
+            )
+        elif method == 'trust-constr':
+            budget = LinearConstraint(ones((1, len(self.__curves))), self.budget, self.budget)
+
+            self.solution = minimize(
+                fun=self.fun,
+                x0=x0,
+                args=(-1.0,),
+                method='trust-constr',
+                jac=self.derivative,
+                bounds=self.__bounds,
+                constraints=budget,
+                options={
+                    'disp': disp,
+                    'maxiter': maxiter
+                }
+            )
+        elif method == 'softmax':
+            self.solution = self._solve_softmax(x0, disp, maxiter)
+        else:
+            raise ValueError("Unknown method '{0}', expected 'SLSQP', 'trust-constr' or 'softmax'".format(method))
 
         return self.solution.x
 
+    def _solve_softmax(self, x0, disp, maxiter):
+        """
+        Solve problem without budget constraint by substituting
+        x = lower + (budget - sum(lower)) * softmax(theta, 0), theta in R^(n-1).
+        Every theta gives spends that sum up to budget and respect lower bounds, so L-BFGS-B runs without
+        constraints. Upper bounds are not represented, so every upper bound must allow whole budget left after
+        lower bounds, otherwise ValueError is raised.
+        :param x0: starting budgets
+        :return: scipy.optimize.OptimizeResult with budgets in ```x``` and their derivative in ```jac```
+        """
+        lower = array([bound[0] for bound in self.__bounds], dtype=float64)
+        upper = array([bound[1] for bound in self.__bounds], dtype=float64)
+        free = self.budget - lower.sum()
+        if free < 0:
+            raise ValueError("Lower bounds exceed budget")
+        if (upper < lower + free).any():
+            raise ValueError("Upper bounds may bind, softmax method can't respect them, use 'SLSQP' instead")
+
+        if self.__packed:
+            fun, derivative = self._shared_evaluation()
+        else:
+            fun, derivative = self.fun, self.derivative
+
+        def budgets(theta):
+            z = append(theta, 0.0)
+            e = exp(z - z.max())
+            share = e / e.sum()
+            return lower + free * share, share
+
+        def fun_and_grad(theta):
+            x, share = budgets(theta)
+            g = derivative(x, -1.0)
+            # chain rule through softmax: d x_i / d z_j = free * share_i * (delta_ij - share_j)
+            grad = free * share * (g - share.dot(g))
+            return fun(x, -1.0), grad[:-1]
+
+        share0 = (x0 - lower) / free if free > 0 else ones(len(x0))
+        theta0 = log(maximum(share0[:-1], 1e-12)) - log(max(share0[-1], 1e-12))
+
+        solution = minimize(fun=fun_and_grad, x0=theta0, method='L-BFGS-B', jac=True, options={'maxiter': maxiter})
+        solution.x, _ = budgets(solution.x)
+        solution.jac = derivative(solution.x, -1.0).copy()
+
+        # L-BFGS-B disp option is deprecated, so summary is printed here in the same form as SLSQP does
+        if disp:
+            print(solution.message)
+            print("            Current function value: {0}".format(solution.fun))
+            print("            Iterations: {0}".format(solution.nit))
+            print("            Function evaluations: {0}".format(solution.nfev))
+            print("            Gradient evaluations: {0}".format(solution.njev))
+        return solution
+
     def plot(self, names=None, budget=None, ext='png'):
         """
         Render all response curves to single plot. If ```notebook_mode``` is ```True```,
@@ -169,23 +418,27 @@ class Knapsack(object):
         else:
             x = linspace(0, self.budget + int(self.budget / 100), 1000)
 
+        self._refresh()
+        if self.__packed:
+            data = responses(x, *self._params)
+        else:
+            data = column_stack([curve(x) for curve in self.__curves])
+
         if names:
-            data = {name: curve(x) for name, curve in zip(names, self.__curves)}
+            names = list(names)[:data.shape[1]]
+            data = data[:, :len(names)]
         else:
-            data = {'y {0}'.format({i + 1}): curve(x) for i, curve in enumerate(self.__curves)}
-
-        lines = DataFrame(
-            data=data,
-            index=x
-        ) \
-            .plot(
-            kind='line',
-            figsize=(12, 10),
-            grid=True
-        )
+            names = ['y {0}'.format({i + 1}) for i in range(data.shape[1])]
+
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots(figsize=(12, 10))
+        for line, name in zip(ax.plot(x, data), names):
+            line.set_label(name)
+        ax.legend()
+        ax.grid(True)
 
         if self.notebook_mode:
-            return lines
+            return ax
         else:
-            fig = lines.get_figure()
-            fig.savefig("plot.".format(ext))
+            fig.savefig(f"plot.{ext}")
@@ -2,8 +2,7 @@
 
 
 from functools import partial
-from numpy import array, exp, ndarray
-from pandas import Series
+from numpy import asarray, divide, errstate, exp, float64, ndim, ones_like, power, where
 
 
 def basic(x, cap=1, ec50=0.5, steep=0, price=1, multiplier=1):
@@ -20,21 +19,28 @@ def basic(x, cap=1, ec50=0.5, steep=0, price=1, multiplier=1):
     :param multiplier: model coefficient for curve
     :return: float with same dimensions as x.
     """
-    if isinstance(x, int) or isinstance(x, float):
-        return (cap / (1 + (x / price / cap / ec50) ** (-steep))) * multiplier if x != 0 else 0
-    elif isinstance(x, Series) or isinstance(x, ndarray):
-        if 0 not in x:
-            return array(cap / (1 + (x / price / cap / ec50) ** (-steep))) * multiplier
-        else:
-            return array([(cap / (1 + (y / price / cap / ec50) ** (-steep))) * multiplier if y != 0 else 0 for y in x])
-    #
-    # return (cap / (1 + (x / price / cap / ec50) ** (-steep))) * multiplier
+    return _basic(x, cap, price * cap * ec50, steep, multiplier)
+
+
+def _basic(x, cap, scale, steep, multiplier):
+    """
+    basic() with price * cap * ec50 precomputed as scale.
+    """
+    if isinstance(x, (int, float)) or ndim(x) == 0:
+        return (cap / (1 + (x / scale) ** (-steep))) * multiplier if x != 0 else 0
+    x = asarray(x, dtype=float64)
+    # zero budget gives zero response, so ratio is masked to 1 there to avoid dividing by zero in power
+    ratio = divide(x, scale, out=ones_like(x), where=x != 0)
+    return where(x == 0, 0.0, multiplier * cap / (1.0 + power(ratio, -steep)))
 
 
 def basic_derivative(x, cap, ec50, steep, price=1, multiplier=1):
-    numerator = cap * steep * multiplier * (x / (cap * ec50 * price)) ** steep
-    denominator = x * (1 + (x / (cap * ec50 * price)) ** steep) ** 2
-    return numerator / denominator
+    return _basic_derivative(x, cap, cap * ec50 * price, steep, multiplier)
+
+
+def _basic_derivative(x, cap, scale, steep, multiplier):
+    r = (x / scale) ** steep
+    return cap * steep * multiplier * r / (x * (1 + r) ** 2)
 
 
 def log(x, cap, ec50, steep, price=1, multiplier=1):
@@ -52,13 +58,32 @@ def log(x, cap, ec50, steep, price=1, multiplier=1):
     :param multiplier:
     :return: float with same dimensions as x.
     """
-    return (cap / (1 + exp(-steep * x / price / cap - ec50)) - cap / (1 + exp(steep * ec50))) * multiplier
+    return _log(x, cap, ec50, steep, price * cap, _log_base(cap, ec50, steep), multiplier)
+
+
+def _log_base(cap, ec50, steep):
+    """
+    x-independent term subtracted in log(). Vanishes when exp(steep * ec50) overflows to inf.
+    """
+    with errstate(over='ignore'):
+        return cap / (1 + exp(steep * ec50))
+
+
+def _log(x, cap, ec50, steep, scale, base, multiplier):
+    """
+    log() with price * cap precomputed as scale and _log_base() as base.
+    """
+    a = exp(-steep * x / scale - ec50)
+    return (cap / (1 + a) - base) * multiplier
 
 
 def log_derivative(x, cap, ec50, steep, price=1, multiplier=1):
-    numerator = steep * multiplier * exp(steep * x / price / cap + ec50)
-    denominator = (exp(steep * x / price / cap + ec50) + 1) ** 2
-    return numerator / denominator
+    return _log_derivative(x, ec50, steep, price * cap, multiplier)
+
+
+def _log_derivative(x, ec50, steep, scale, multiplier):
+    e = exp(steep * x / scale + ec50)
+    return steep * multiplier * e / (e + 1.0) ** 2
 
 
 def art(x, a, b, multiplier=1):
@@ -74,7 +99,39 @@ def art_derivative(x, a, b, multiplier=1.0):
     return numerator / denominator
 
 
+# response function and its derivative for every Curve type, taking parameters precomputed by Curve
+_CURVE_TYPES = {
+    'basic': (_basic, _basic_derivative),
+    'log': (_log, _log_derivative),
+}
+
+
+def _parameter(name):
+    """
+    Curve parameter property. Setting it recomputes constants cached by Curve.
+    """
+    attr = '_' + name
+
+    def get(self):
+        return getattr(self, attr)
+
+    def set(self, value):
+        setattr(self, attr, value)
+        self._update()
+
+    return property(get, set)
+
+
 class Curve(object):
+    __slots__ = ('_cap', '_ec50', '_steep', '_multiplier', '_price', '_type', '_impl', '_dimpl', '_scale', '_base',
+                 '_args', '_dargs')
+
+    cap = _parameter('cap')
+    ec50 = _parameter('ec50')
+    steep = _parameter('steep')
+    multiplier = _parameter('multiplier')
+    price = _parameter('price')
+
     # TODO LaTeX curve equation rendering
     def __init__(self, cap, ec50, steep, multiplier=1, price=1, curve_type='basic'):
         """
@@ -87,46 +144,51 @@ class Curve(object):
         :param multiplier: model coefficient for curve
         :param curve_type: regular or logistic response curve, can be 'basic' or 'log'
         """
-        self.cap = cap
-        self.ec50 = ec50
-        self.steep = steep
-        self.multiplier = multiplier
-        self.price = price
+        self._cap = cap
+        self._ec50 = ec50
+        self._steep = steep
+        self._multiplier = multiplier
+        self._price = price
         self.type = curve_type
 
+    @property
+    def type(self):
+        return self._type
+
+    @type.setter
+    def type(self, curve_type):
+        if curve_type not in _CURVE_TYPES:
+            raise ValueError("Unknown curve type '{0}', expected 'basic' or 'log'".format(curve_type))
+        self._type = curve_type
+        self._impl, self._dimpl = _CURVE_TYPES[curve_type]
+        self._update()
+
+    def _update(self):
+        """
+        Precompute x-independent constants of response function, so they are not evaluated on every call.
+        _scale divides x inside response function, _base is subtracted from 'log' response.
+        """
+        if self._type == 'basic':
+            self._scale = self._price * self._cap * self._ec50
+            self._base = 0.0
+            self._args = (self._cap, self._scale, self._steep, self._multiplier)
+            self._dargs = self._args
+        else:
+            self._scale = self._price * self._cap
+            self._base = _log_base(self._cap, self._ec50, self._steep)
+            self._args = (self._cap, self._ec50, self._steep, self._scale, self._base, self._multiplier)
+            self._dargs = (self._ec50, self._steep, self._scale, self._multiplier)
+
     @property
     def fun(self):
-        if self.type == 'basic':
-            return partial(basic,
-                           cap=self.cap,
-                           ec50=self.ec50,
-                           steep=self.steep,
-                           price=self.price,
-                           multiplier=self.multiplier)
-        elif self.type == 'log':
-            return partial(log,
-                           cap=self.cap,
-                           ec50=self.ec50,
-                           steep=self.steep,
-                           price=self.price,
-                           multiplier=self.multiplier)
+        return self.__call__
 
     @property
     def derivative(self):
-        if self.type == 'basic':
-            return partial(basic_derivative,
-                           cap=self.cap,
-                           ec50=self.ec50,
-                           steep=self.steep,
-                           price=self.price,
-                           multiplier=self.multiplier)
-        elif self.type == 'log':
-            return partial(log_derivative,
-                           cap=self.cap,
-                           ec50=self.ec50,
-                           steep=self.steep,
-                           price=self.price,
-                           multiplier=self.multiplier)
+        return self._derivative
+
+    def _derivative(self, x):
+        return self._dimpl(x, *self._dargs)
 
     def __call__(self, x):
         """
@@ -134,7 +196,7 @@ class Curve(object):
         :param x: budget
         :return:  float64
         """
-        return self.fun(x)
+        return self._impl(x, *self._args)
 
 
 # noinspection PyMissingConstructor
@@ -168,7 +230,7 @@ class MixedCurve(object):
     """
 
     def __init__(self, *curves):
-        self.curves = curves
+        self.curves = tuple(curves)
 
     def __call__(self, x):
         return self.fun(x)
@@ -179,14 +241,27 @@ class MixedCurve(object):
         Callable that can be passed further.
         """
 
+        # results are added in place to the first one, so only one result array is allocated
         def f(x):
-            return sum([curve(x) for curve in self.curves])
+            curves = self.curves
+            if not curves:
+                return 0
+            total = curves[0](x)
+            for curve in curves[1:]:
+                total += curve(x)
+            return total
 
         return f
 
     @property
     def derivative(self):
         def d(x):
-            return sum([curve.derivative(x) for curve in self.curves])
+            curves = self.curves
+            if not curves:
+                return 0
+            total = curves[0].derivative(x)
+            for curve in curves[1:]:
+                total += curve.derivative(x)
+            return total
 
         return d
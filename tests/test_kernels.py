@@ -0,0 +1,80 @@
+import importlib.util
+import warnings
+
+import numpy as np
+import pytest
+
+import knapsack
+import knapsack._kernels
+from knapsack import Curve, Knapsack
+from knapsack.stones import basic, basic_derivative, log, log_derivative
+
+CURVES = [
+    Curve(397650, 0.5085217, 0.92, 9.168728e-06 / 87.98509),
+    Curve(1336580, 0.941772, 0.9964167, 7.202334e-07, curve_type='log'),
+    Curve(3191.663, 10000, 0.75, 0.001353697 / 65, price=1.7),
+    Curve(237349.3, 0.9954354, 0.7, 9.501362e-06 / 12.47645, curve_type='log'),
+]
+
+
+def load_kernels(numba, monkeypatch):
+    """
+    knapsack._kernels if it was imported with requested branch, otherwise a fresh copy of it for NumPy branch.
+    numba branch is only tested when tests run with KNAPSACK_NUMBA=1: a renamed copy must not be compiled by numba,
+    it would leave entries for an unimportable module in its cache.
+    """
+    if (knapsack._kernels.njit is not None) == numba:
+        return knapsack._kernels
+    if numba:
+        pytest.skip('numba kernels are enabled with KNAPSACK_NUMBA=1')
+    monkeypatch.delenv('KNAPSACK_NUMBA')
+    path = knapsack.__path__[0] + '/_kernels.py'
+    spec = importlib.util.spec_from_file_location('_kernels_without_numba', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert module.njit is None
+    return module
+
+
+def packed_params():
+    budget = Knapsack(1e7)
+    for curve in CURVES:
+        budget.add_curve(curve)
+    budget.fun
+    return budget._params
+
+
+def expected(x):
+    value, grad = [], []
+    for curve, spend in zip(CURVES, x):
+        function, derivative = (basic, basic_derivative) if curve.type == 'basic' else (log, log_derivative)
+        args = curve.cap, curve.ec50, curve.steep, curve.price, curve.multiplier
+        value.append(function(spend, *args))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            grad.append(derivative(spend, *args))
+    return np.array(value), np.array(grad)
+
+
+@pytest.mark.parametrize('numba', [True, False])
+@pytest.mark.parametrize('x', [
+    np.array([1e6, 2e6, 3e6, 4e6]),
+    np.array([1.0, 5e7, 3e5, 1e7]),
+    np.array([0.0, 2e6, 0.0, 4e6]),
+    np.array([1e6, 0.0, 3e6, 4e6]),
+])
+def test_kernels_match_stones(numba, x, monkeypatch):
+    kernels = load_kernels(numba, monkeypatch)
+    params = packed_params()
+    value, grad = expected(x)
+    finite = np.isfinite(grad)
+
+    # kernels must not warn, also at zero budget where 'basic' derivative is nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert np.isclose(kernels.response(x, *params), value.sum())
+        assert np.allclose(np.diag(kernels.responses(x, *params)), value)
+        out = kernels.response_grad(np.empty(x.size), x, *params)
+        assert np.allclose(out[finite], grad[finite])
+        out = np.empty(x.size)
+        assert np.isclose(kernels.response_and_grad(out, x, *params), value.sum())
+        assert np.allclose(out[finite], grad[finite])
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from knapsack import Curve, Knapsack
+
+PARAMS = [
+    (397650, 0.5085217, 0.92, 9.168728e-06 / 87.98509),
+    (1336580, 0.941772, 0.9964167, 7.202334e-07),
+    (5.509022, 5000, 0.99, 0.0002982394 / 219),
+]
+
+
+def make_knapsack():
+    budget = Knapsack(30000000)
+    for params in PARAMS:
+        budget.add_curve(Curve(*params), 1000000, 30000000)
+    return budget
+
+
+@pytest.mark.parametrize('size', [2, 4])
+def test_wrong_budget_count(size):
+    budget = make_knapsack()
+    x = np.full(size, 1e6)
+    with pytest.raises(ValueError):
+        budget(x)
+    with pytest.raises(ValueError):
+        budget.derivative(x)
+
+
+def test_curve_change_after_add():
+    budget = make_knapsack()
+    x = np.full(len(PARAMS), 1e7)
+    before = budget(x)
+    budget.get_curves()[0].cap = 500000
+    expected = sum(curve(spend) for curve, spend in zip(budget.get_curves(), x))
+    assert not np.isclose(budget(x), before)
+    assert np.isclose(budget(x), expected)
+
+
+def test_softmax_solution_spends_budget():
+    budget = make_knapsack()
+    x = budget.solve(disp=False, method='softmax')
+    assert np.isclose(x.sum(), budget.budget)
+    assert all(lower <= spend <= upper for spend, (lower, upper) in zip(x, budget.get_bounds()))
+
+
+def test_robust_seed_reproducible():
+    first = make_knapsack().solve(disp=False, robust=True, seed=1)
+    second = make_knapsack().solve(disp=False, robust=True, seed=1)
+    assert np.array_equal(first, second)
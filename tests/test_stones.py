@@ -0,0 +1,15 @@
+import numpy as np
+
+from knapsack import Curve
+from knapsack.stones import log
+
+
+def test_log_large_steep_ec50():
+    # exp(steep * ec50) overflows float64, base term must vanish instead of raising
+    curve = Curve(5.509022, 5000, 0.99, 0.0002982394 / 219, curve_type='log')
+    assert np.isfinite(curve(1e6))
+    assert np.isclose(log(1e6, 5.5, 5000, 0.99, 1e-6), 5.5)
+
+
+def test_log_array_parameters():
+    np.testing.assert_allclose(log(1.0, 1.0, np.array([0.5, 0.6]), 0.9), [0.4128, 0.4494], atol=1e-4)